@@ -1,9 +1,8 @@
 #!/bin/bash
 echo "Installing Azure Computer Vision dependencies..."
 
-# Install Azure SDK packages
-pip install azure-cognitiveservices-vision-computervision==0.9.0
-pip install msrest==0.7.1
+# Object detection calls the Computer Vision REST API directly, no Azure SDK needed
+pip install requests
 pip install python-dotenv==1.0.0
 
 echo "Azure dependencies installed successfully!"
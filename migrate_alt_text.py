@@ -12,9 +12,12 @@ from pathlib import Path
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
+# This script runs the migration itself, don't start the background one too
+os.environ['MIGRATION_MODE'] = 'skip'
+
 from moments import create_app
 from moments.core.extensions import db
-from sqlalchemy import text
+from moments.core.migrations import add_alt_text_column
 
 def migrate_alt_text():
     """Add alt_text column to photo table."""
@@ -22,20 +25,14 @@ def migrate_alt_text():
     
     with app.app_context():
         try:
-            # Check if column already exists
-            inspector = db.inspect(db.engine)
-            columns = [col['name'] for col in inspector.get_columns('photo')]
+            with db.engine.connect() as conn:
+                added = add_alt_text_column(conn)
+                conn.commit()
             
-            if 'alt_text' in columns:
+            if not added:
                 print("Column 'alt_text' already exists in photo table.")
                 return
             
-            # Add the new column
-            print("Adding alt_text column to photo table...")
-            with db.engine.connect() as conn:
-                conn.execute(text("ALTER TABLE photo ADD COLUMN alt_text VARCHAR(500)"))
-                conn.commit()
-            
             print("✅ Database migration completed successfully!")
             print("Column 'alt_text' added to photo table.")
             
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 Database migration script to add detected_objects field to Photo model.
-This script adds the detected_objects column to store ML-detected objects as JSON.
+This script adds the detected_objects column to store ML-detected objects as JSON,
+and creates the photo_object table that indexes them by name.
 """
 
 import os
@@ -14,7 +15,7 @@ sys.path.insert(0, str(project_root))
 
 from flask import Flask
 from moments.core.extensions import db
-from sqlalchemy import text
+from moments.core.migrations import add_detected_objects_column, create_photo_object_table
 
 def create_app():
     """Create Flask app for migration."""
@@ -25,33 +26,26 @@ def create_app():
     return app
 
 def migrate_detected_objects():
-    """Add detected_objects column to photo table."""
+    """Add detected_objects column to photo table and create photo_object table."""
     app = create_app()
     
     with app.app_context():
         try:
-            # Check if column already exists
-            result = db.session.execute(text("""
-                SELECT COUNT(*) as count 
-                FROM pragma_table_info('photo') 
-                WHERE name = 'detected_objects'
-            """)).fetchone()
+            with db.engine.connect() as conn:
+                added = add_detected_objects_column(conn)
+                created = create_photo_object_table(conn)
+                conn.commit()
             
-            if result.count > 0:
+            if added:
+                print("Successfully added 'detected_objects' column to photo table.")
+            else:
                 print("Column 'detected_objects' already exists in photo table.")
-                return
-            
-            # Add the detected_objects column
-            db.session.execute(text("""
-                ALTER TABLE photo 
-                ADD COLUMN detected_objects TEXT
-            """))
-            
-            db.session.commit()
-            print("Successfully added 'detected_objects' column to photo table.")
+            if created:
+                print("Successfully created 'photo_object' table.")
+            else:
+                print("Table 'photo_object' already exists.")
             
         except Exception as e:
-            db.session.rollback()
             print(f"Error adding detected_objects column: {e}")
             raise
 
@@ -10,6 +10,7 @@ from moments.core.commands import register_commands
 from moments.core.errors import register_error_handlers
 from moments.core.extensions import avatars, bootstrap, csrf, db, dropzone, login_manager, mail, whooshee
 from moments.core.logging import register_logging
+from moments.core.migrations import register_migrations
 from moments.core.request import register_request_handlers
 from moments.core.templating import register_template_handlers
 from moments.settings import config
@@ -45,6 +46,7 @@ def create_app(config_name):
     register_template_handlers(app)
     register_request_handlers(app)
     register_error_handlers(app)
+    register_migrations(app)
 
     # Whooshee temporarily disabled - will re-enable after fixing schema
     # try:
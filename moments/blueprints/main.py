@@ -1,14 +1,28 @@
-from flask import Blueprint, abort, current_app, flash, redirect, render_template, request, send_from_directory, url_for
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    flash,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    send_from_directory,
+    url_for,
+)
 from flask_login import current_user, login_required
 from sqlalchemy import func, select
 from sqlalchemy.orm import with_parent
 
 from moments.core.extensions import db
+from moments.core.migrations import MIGRATION_STATE
 from moments.decorators import confirm_required, permission_required
 from moments.forms.main import CommentForm, DescriptionForm, TagForm
-from moments.models import Collection, Comment, Follow, Notification, Photo, Tag, User
+from moments.models import Collection, Comment, Follow, Notification, Photo, PhotoObject, Tag, User
 from moments.notifications import push_collect_notification, push_comment_notification
-from moments.utils import flash_errors, redirect_back, rename_image, resize_image, validate_image
+from moments.utils import flash_errors, loads_json, redirect_back, rename_image, resize_image, validate_image
 
 main_bp = Blueprint('main', __name__)
 
@@ -127,6 +141,11 @@ def read_all_notification():
     return redirect(url_for('.show_notifications'))
 
 
+@main_bp.route('/healthz')
+def healthz():
+    return jsonify(status='ok', migrations=dict(MIGRATION_STATE))
+
+
 @main_bp.route('/images/<path:filename>')
 def get_image(filename):
     return send_from_directory(current_app.config['MOMENTS_UPLOAD_PATH'], filename)
@@ -158,13 +177,21 @@ def upload():
         
         # Generate alternative text and detect objects using ML service
         try:
-            from moments.ml_service import get_ml_service
+            from moments.ml_service import CAPTION_TIMEOUT, get_caption_batcher, get_ml_service
             ml_service = get_ml_service()
             image_path = str(current_app.config['MOMENTS_UPLOAD_PATH'] / filename)
+            # The upload is still buffered, caption it from memory instead of re-reading the saved file
+            f.stream.seek(0)
+            image_bytes = f.stream.read()
             
             # Generate alternative text
             if ml_service.is_available():
-                alt_text = ml_service.generate_alternative_text(image_path)
+                # Queue through the batcher so concurrent uploads share one forward pass
+                try:
+                    alt_text = get_caption_batcher().submit(image_bytes).result(timeout=CAPTION_TIMEOUT)
+                except FuturesTimeoutError:
+                    alt_text = None
+                    current_app.logger.warning(f"Timed out generating alt text for {filename}")
                 if alt_text:
                     photo.alt_text = alt_text
                     current_app.logger.info(f"Generated alt text for {filename}: {alt_text}")
@@ -181,12 +208,19 @@ def upload():
                     current_app.logger.info(f"Detected objects for {filename}: {detected_objects}")
                     # Create tags from detected objects
                     try:
-                        import json
-                        objects = json.loads(detected_objects)
-                        for obj in objects:
+                        # Normalize names once so photo_object rows and tags agree
+                        objects = []
+                        for obj in loads_json(detected_objects):
                             name = (obj.get('name') or '').strip()
-                            if not name:
-                                continue
+                            if name:
+                                objects.append(PhotoObject(name=name, confidence=obj.get('confidence')))
+                        # photo_object may not exist yet (MIGRATION_MODE=skip, or the migration hasn't finished)
+                        if db.inspect(db.engine).has_table(PhotoObject.__tablename__):
+                            # One row per object, flushed as a single multi-row INSERT
+                            photo.objects = objects
+                        else:
+                            current_app.logger.warning('Table photo_object missing, run the database migrations')
+                        for name in (obj.name for obj in objects):
                             tag = db.session.scalar(select(Tag).filter_by(name=name))
                             if tag is None:
                                 tag = Tag(name=name)
@@ -0,0 +1,115 @@
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+from moments.core.extensions import db
+from moments.models import PhotoObject
+
+# Shared by every app instance so only one of them runs the migrations at a time
+MIGRATION_LOCK_KEY = 42
+
+# Exposed by the /healthz endpoint
+MIGRATION_STATE = {'status': 'pending'}
+
+
+def photo_columns(conn):
+    """Return the set of column names of the photo table."""
+    return {col['name'] for col in db.inspect(conn).get_columns('photo')}
+
+
+def add_photo_column(conn, name, column_type, columns=None):
+    """Add a column to photo table unless it exists. Return True if the column was added."""
+    if columns is None:
+        columns = photo_columns(conn)
+    if name in columns:
+        return False
+    # Let PostgreSQL no-op if a concurrent run added it first; SQLite has no IF NOT EXISTS here
+    if_not_exists = 'IF NOT EXISTS ' if conn.dialect.name == 'postgresql' else ''
+    conn.execute(text(f'ALTER TABLE photo ADD COLUMN {if_not_exists}{name} {column_type}'))
+    columns.add(name)
+    return True
+
+
+def add_alt_text_column(conn, columns=None):
+    """Add alt_text column to photo table. Return True if the column was added."""
+    return add_photo_column(conn, 'alt_text', 'VARCHAR(500)', columns)
+
+
+def add_detected_objects_column(conn, columns=None):
+    """Add detected_objects column to photo table. Return True if the column was added."""
+    return add_photo_column(conn, 'detected_objects', 'TEXT', columns)
+
+
+def create_photo_object_table(conn, columns=None):
+    """Create photo_object table and its (name, confidence DESC) index. Return True if created."""
+    if db.inspect(conn).has_table(PhotoObject.__tablename__):
+        return False
+    PhotoObject.__table__.create(conn)
+    return True
+
+
+MIGRATIONS = (add_alt_text_column, add_detected_objects_column, create_photo_object_table)
+
+
+@contextmanager
+def advisory_lock(conn):
+    """Try to take the migration advisory lock, yield whether it was acquired.
+
+    The lock is transaction-level, so PostgreSQL releases it on commit or rollback,
+    including when a migration fails. Only PostgreSQL has advisory locks; other
+    databases always yield True.
+    """
+    if conn.dialect.name != 'postgresql':
+        yield True
+        return
+    yield conn.execute(text('SELECT pg_try_advisory_xact_lock(:key)'), {'key': MIGRATION_LOCK_KEY}).scalar()
+
+
+def run_migrations(app):
+    with app.app_context():
+        MIGRATION_STATE['status'] = 'running'
+        try:
+            with db.engine.connect() as conn, advisory_lock(conn) as acquired:
+                if not acquired:
+                    # Another instance is migrating the same database
+                    MIGRATION_STATE['status'] = 'locked'
+                    return
+                # A fresh database gets the full schema from `flask init-db` instead
+                applied = []
+                if db.inspect(conn).has_table('photo'):
+                    # Inspect the table once and share the result between migrations
+                    columns = photo_columns(conn)
+                    applied = [migration.__name__ for migration in MIGRATIONS if migration(conn, columns)]
+                conn.commit()
+        except Exception as e:
+            # The error details stay in the log, /healthz is not authenticated
+            app.logger.error(f'Database migration failed: {e}')
+            MIGRATION_STATE['status'] = 'failed'
+            return
+        MIGRATION_STATE.update(status='done', applied=applied)
+        if applied:
+            app.logger.info(f'Applied database migrations: {", ".join(applied)}')
+
+
+def register_migrations(app):
+    mode = app.config['MOMENTS_MIGRATION_MODE']
+    if mode == 'skip':
+        MIGRATION_STATE['status'] = 'skipped'
+    elif mode == 'sync':
+        run_migrations(app)
+    else:
+        # Start on the first request rather than in create_app, so CLI commands like
+        # `flask init-db --drop` don't race a migration thread on the same database
+        started = threading.Event()
+        start_lock = threading.Lock()
+
+        @app.before_request
+        def start_migrations():
+            if started.is_set():
+                return
+            with start_lock:
+                if started.is_set():
+                    return
+                threading.Thread(target=run_migrations, args=(app,), name='migrations', daemon=True).start()
+                started.set()
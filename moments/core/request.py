@@ -1,7 +1,27 @@
+import threading
+
 from flask_sqlalchemy.record_queries import get_recorded_queries
 
 
 def register_request_handlers(app):
+    if app.config['MOMENTS_ML_WARMUP']:
+        # Start on the first request rather than in create_app, so CLI commands don't load the models
+        warm_up_started = threading.Event()
+        warm_up_lock = threading.Lock()
+
+        @app.before_request
+        def start_ml_warm_up():
+            if warm_up_started.is_set():
+                return
+            with warm_up_lock:
+                if warm_up_started.is_set():
+                    return
+                # Imported here so apps without warm-up don't pay for importing the ML libraries
+                from moments.ml_service import warm_up_in_background
+
+                warm_up_in_background()
+                warm_up_started.set()
+
     @app.after_request
     def query_profiler(response):
         for q in get_recorded_queries():
@@ -1,194 +1,866 @@
 """
 ML Service for generating alternative text from images and object detection.
-Uses Azure Computer Vision API for object detection and local transformers for captioning.
+Uses local transformers for captioning and a pluggable object detector:
+Azure Computer Vision API or a local YOLO model, selected with OBJECT_DETECTOR.
 """
 
+import importlib
+import io
 import logging
+import math
+import mmap
 import os
-from typing import Optional
+import platform
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from typing import Optional, Union
+
+from moments.utils import dumps_json, loads_json
+
+# Load CUDA kernels on first use instead of all at once when torch initializes CUDA.
+# Must be set before torch is imported.
+os.environ.setdefault("CUDA_MODULE_LOADING", "LAZY")
 
 try:
     from transformers import pipeline
     import torch
     from PIL import Image
-    import json
     ML_AVAILABLE = True
 except ImportError:
     ML_AVAILABLE = False
     logging.warning("ML libraries not available. Alternative text generation will be disabled.")
 
 try:
-    from azure.cognitiveservices.vision.computervision import ComputerVisionClient
-    from azure.cognitiveservices.vision.computervision.models import VisualFeatureTypes
-    from msrest.authentication import CognitiveServicesCredentials
+    from torchvision.io import ImageReadMode, decode_image, decode_jpeg, read_file
+    from torchvision.transforms.functional import normalize, resize
+    TORCHVISION_AVAILABLE = True
+except ImportError:
+    TORCHVISION_AVAILABLE = False
+
+try:
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForVision2Seq, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    ORT_AVAILABLE = True
+except ImportError:
+    ORT_AVAILABLE = False
+
+try:
+    import diskcache
+    DISKCACHE_AVAILABLE = True
+except ImportError:
+    DISKCACHE_AVAILABLE = False
+
+try:
+    from blake3 import blake3 as content_hasher
+except ImportError:
+    from hashlib import blake2b as content_hasher
+
+try:
     from dotenv import load_dotenv
-    AZURE_AVAILABLE = True
     # Load environment variables
     load_dotenv()
 except ImportError:
-    AZURE_AVAILABLE = False
-    logging.warning("Azure Computer Vision SDK not available. Object detection will be disabled.")
+    pass
 
 logger = logging.getLogger(__name__)
 
+# Images can be captioned from a file path or from bytes already in memory (e.g. an upload)
+ImageSource = Union[str, bytes]
 
-class MLImageService:
-    """Service for ML-powered image analysis and alternative text generation."""
+CAPTION_MODEL_NAME = "nlpconnect/vit-gpt2-image-captioning"
+# "auto" uses ONNX Runtime when optimum[onnxruntime] is installed, "onnx" asks for it, "transformers" disables it
+CAPTION_BACKEND = os.getenv('ML_CAPTION_BACKEND', 'auto')
+# Where the exported ONNX model (and the TensorRT engine cache) is kept between runs
+ONNX_MODEL_DIR = os.getenv('ML_ONNX_MODEL_DIR', 'onnx_models/vit-gpt2-image-captioning')
+# Set to "int8" to run the ONNX caption model with dynamically quantized weights on CPU
+CAPTION_QUANTIZE = os.getenv('ML_CAPTION_QUANTIZE', '')
+# ORTModelForVision2Seq.from_pretrained file name arguments and the exported file each one loads
+ONNX_CAPTION_FILES = (
+    ('encoder_file_name', 'encoder_model'),
+    ('decoder_file_name', 'decoder_model'),
+    ('decoder_with_past_file_name', 'decoder_with_past_model'),
+)
+
+# Object detection backend: "azure", "yolo" or "none"
+OBJECT_DETECTOR = os.getenv('OBJECT_DETECTOR', 'azure')
+
+AZURE_ANALYZE_PATH = '/vision/v3.2/analyze'
+# Seconds to wait for Azure to accept the upload and return the analysis
+AZURE_TIMEOUT = float(os.getenv('AZURE_COMPUTER_VISION_TIMEOUT', '30'))
+# Number of Azure requests kept in flight at once by detect_objects_batch
+AZURE_MAX_WORKERS = int(os.getenv('AZURE_COMPUTER_VISION_MAX_WORKERS', '8'))
+
+# Keep-alive connections kept to the Azure endpoint; at least one per in-flight request
+AZURE_POOL_SIZE = max(int(os.getenv('AZURE_COMPUTER_VISION_POOL_SIZE', '32')), AZURE_MAX_WORKERS)
+
+YOLO_MODEL = os.getenv('YOLO_MODEL', 'yolov8n.pt')
+# Set to "int8" to run YOLO from an INT8 OpenVINO export of YOLO_MODEL (VNNI on CPU)
+YOLO_QUANTIZE = os.getenv('YOLO_QUANTIZE', '')
+
+# Results are cached by image content hash so retries and re-uploads skip inference
+ML_CACHE_DIR = os.getenv('ML_CACHE_DIR', 'ml_cache')
+ML_CACHE_SIZE_LIMIT = int(float(os.getenv('ML_CACHE_SIZE_LIMIT', '2e9')))
+# Cached detection result for images with no objects above the confidence threshold
+NO_OBJECTS = '[]'
+
+# Maximum number of images pushed through the caption pipeline in one forward pass
+CAPTION_BATCH_SIZE = int(os.getenv('ML_CAPTION_BATCH_SIZE', '8'))
+# How long the caption batcher waits for more requests before flushing a partial batch
+CAPTION_BATCH_WINDOW = float(os.getenv('ML_CAPTION_BATCH_WINDOW_MS', '50')) / 1000
+# Seconds an upload waits for its caption; the first one also waits for the model to load
+CAPTION_TIMEOUT = float(os.getenv('ML_CAPTION_TIMEOUT', '120'))
+
+
+def best_objects(detections) -> list[dict]:
+    """
+    Keep the most confident detection (> 0.5) per object name, sorted by confidence.
+    detections is an iterable of (name, confidence) pairs.
+    """
+    best = {}
+    for name, confidence in detections:
+        if confidence > 0.5 and confidence > best.get(name, 0.0):
+            best[name] = confidence
+    return [
+        {'name': name, 'confidence': round(confidence, 2)}
+        for name, confidence in sorted(best.items(), key=lambda item: item[1], reverse=True)
+    ]
+
+
+class AzureObjectDetector:
+    """Object detection through the Azure Computer Vision REST API."""
+
+    def __init__(self):
+        requests = importlib.import_module('requests')
+        self.endpoint = None
+        self.key = None
+        self._http_pool = ThreadPoolExecutor(max_workers=AZURE_MAX_WORKERS, thread_name_prefix='azure-vision')
+        # One session for every call, so TCP + TLS connections are reused instead of re-handshaken
+        self._session = requests.Session()
+        self._session.mount('https://', requests.adapters.HTTPAdapter(
+            pool_connections=AZURE_POOL_SIZE, pool_maxsize=AZURE_POOL_SIZE, pool_block=False
+        ))
+
+        endpoint = os.getenv('AZURE_COMPUTER_VISION_ENDPOINT')
+        key = os.getenv('AZURE_COMPUTER_VISION_KEY')
+        if endpoint and key:
+            self.endpoint = endpoint.rstrip('/')
+            self.key = key
+            self._session.headers['Ocp-Apim-Subscription-Key'] = key
+            logger.info("Azure Computer Vision client initialized successfully")
+        else:
+            logger.warning("Azure credentials not found in environment variables")
+
+    @property
+    def cache_kind(self) -> str:
+        return 'azure'
+
+    def is_available(self) -> bool:
+        return self.endpoint is not None and self.key is not None
+
+    def warm_up(self):
+        """Nothing to load for a REST client."""
+
+    def detect(self, image_path: str) -> Optional[list[dict]]:
+        """Return the detected objects for an image, or None if the request failed."""
+        try:
+            # Post the file object itself to the REST endpoint: requests streams it in
+            # blocks instead of the SDK reading the whole image into memory first
+            with open(image_path, 'rb') as image_file:
+                response = self._session.post(
+                    self.endpoint + AZURE_ANALYZE_PATH,
+                    params={'visualFeatures': 'Objects'},
+                    headers={'Content-Type': 'application/octet-stream'},
+                    data=image_file,
+                    timeout=AZURE_TIMEOUT,
+                )
+            response.raise_for_status()
+            analysis = loads_json(response.content)
+
+            # Extract objects from Azure response
+            objects = analysis.get('objects') or []
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Azure objects: %d", len(objects))
+            return best_objects((obj.get('object', 'unknown'), obj.get('confidence', 0.0)) for obj in objects)
+        except Exception as e:
+            logger.error(f"Error detecting objects with Azure: {e}")
+            return None
+
+    def detect_batch(self, image_paths: list[str]) -> list[Optional[list[dict]]]:
+        """Detect objects in several images, overlapping the Azure round trips on a thread pool."""
+        if len(image_paths) == 1:
+            # Nothing to overlap, skip the hop through the pool
+            return [self.detect(image_paths[0])]
+
+        results: list[Optional[list[dict]]] = [None] * len(image_paths)
+        futures = {self._http_pool.submit(self.detect, path): i for i, path in enumerate(image_paths)}
+        # Each request has its own timeout; allow one timeout per wave of in-flight requests
+        timeout = AZURE_TIMEOUT * math.ceil(len(image_paths) / AZURE_MAX_WORKERS)
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                results[futures[future]] = future.result()
+        except FuturesTimeoutError:
+            logger.error(f"Timed out detecting objects for {len(image_paths)} images with Azure")
+        return results
+
+
+class YOLOObjectDetector:
+    """Object detection with a local ultralytics YOLO model."""
 
     def __init__(self):
-        self.caption_pipeline = None
-        self.azure_client = None
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self._initialize_models()
-
-    def _initialize_models(self):
-        """Initialize ML models for image captioning and Azure Computer Vision."""
-        if not ML_AVAILABLE:
-            logger.warning("ML libraries not available. Cannot initialize models.")
+        self._ultralytics = importlib.import_module('ultralytics')
+        self._np = importlib.import_module('numpy')
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._model_failed = False
+        # The weights that actually loaded: YOLO_MODEL or its INT8 export
+        self._weights = None
+
+    @property
+    def model(self):
+        """YOLO model, loaded on first use."""
+        if self._model is None and not self._model_failed:
+            with self._model_lock:
+                if self._model is None and not self._model_failed:
+                    try:
+                        self._model = self._load_model()
+                        logger.info(f"YOLO model {YOLO_MODEL} loaded successfully")
+                    except Exception as e:
+                        logger.error(f"Failed to load YOLO model {YOLO_MODEL}: {e}")
+                        self._model_failed = True
+        return self._model
+
+    @property
+    def cache_kind(self) -> str:
+        """Names the weights in use, so switching YOLO_MODEL or YOLO_QUANTIZE doesn't serve stale results."""
+        return f"yolo:{self._weights or self._expected_weights()}"
+
+    def _expected_weights(self) -> str:
+        return yolo_int8_dir() if YOLO_QUANTIZE == 'int8' else YOLO_MODEL
+
+    def _load_model(self):
+        if YOLO_QUANTIZE != 'int8':
+            self._weights = YOLO_MODEL
+            return self._ultralytics.YOLO(YOLO_MODEL)
+        quantized_dir = yolo_int8_dir()
+        if not os.path.isdir(quantized_dir):
+            try:
+                exported = self._ultralytics.YOLO(YOLO_MODEL).export(format='openvino', int8=True, dynamic=True)
+                os.replace(exported, quantized_dir)
+                logger.info(f"Quantized {YOLO_MODEL} to INT8 in {quantized_dir}")
+            except Exception as e:
+                logger.warning(f"Failed to quantize YOLO model, using FP32 weights: {e}")
+                self._weights = YOLO_MODEL
+                return self._ultralytics.YOLO(YOLO_MODEL)
+        self._weights = quantized_dir
+        return self._ultralytics.YOLO(quantized_dir, task='detect')
+
+    def is_available(self) -> bool:
+        return not self._model_failed
+
+    def warm_up(self):
+        """Load the model and run one dummy frame so the first real request doesn't pay for CUDA init."""
+        model = self.model
+        if model is None:
             return
+        try:
+            model.predict(self._np.zeros((640, 640, 3), dtype=self._np.uint8), verbose=False)
+        except Exception as e:
+            logger.warning(f"YOLO warm-up failed: {e}")
+
+    def detect(self, image_path: str) -> Optional[list[dict]]:
+        """Return the detected objects for an image, or None if detection failed."""
+        return self.detect_batch([image_path])[0]
+
+    def detect_batch(self, image_paths: list[str]) -> list[Optional[list[dict]]]:
+        """Run all images through YOLO as one batch."""
+        model = self.model
+        if model is None:
+            return [None] * len(image_paths)
+        try:
+            results = model(image_paths, imgsz=640, conf=0.5, verbose=False)
+            return [self._best_per_class(result) for result in results]
+        except Exception as e:
+            logger.error(f"Error detecting objects with YOLO: {e}")
+            return [None] * len(image_paths)
+
+    def _best_per_class(self, result) -> list[dict]:
+        """Highest-confidence box per class, sorted by confidence, computed on the box arrays."""
+        np = self._np
+        classes = result.boxes.cls.cpu().numpy().astype(np.int32)
+        confidences = result.boxes.conf.cpu().numpy()
+        mask = confidences > 0.5
+        classes, confidences = classes[mask], confidences[mask]
+
+        order = np.argsort(-confidences, kind='stable')
+        classes, confidences = classes[order], confidences[order]
+        # First occurrence of each class in descending-confidence order is its best box
+        _, first = np.unique(classes, return_index=True)
+        first.sort()
+        return [
+            {'name': result.names[int(classes[i])], 'confidence': round(float(confidences[i]), 2)}
+            for i in first
+        ]
+
+
+def yolo_int8_dir() -> str:
+    """Where the INT8 export of YOLO_MODEL is kept; ultralytics picks the runtime from the "_openvino_model" suffix."""
+    return f"{os.path.splitext(YOLO_MODEL)[0]}_int8_openvino_model"
+
+
+OBJECT_DETECTORS = {
+    'azure': AzureObjectDetector,
+    'yolo': YOLOObjectDetector,
+}
+
+
+class MLImageService:
+    """Service for ML-powered image analysis and alternative text generation."""
+
+    def __init__(self, detector: str = OBJECT_DETECTOR):
+        self._caption_pipeline = None
+        self._caption_lock = threading.Lock()
+        self._caption_failed = False
+        self.detector_name = detector
+        self.detector = None
+        self.device = "cuda" if ML_AVAILABLE and torch.cuda.is_available() else "cpu"
+        self.cache = None
+        # The caption model variant that actually loaded, e.g. "transformers:float16"
+        self._caption_variant = None
+        self._initialize_detector()
+        self._initialize_cache()
+
+    @property
+    def caption_pipeline(self):
+        """Image captioning pipeline, loaded on first use."""
+        if self._caption_pipeline is None and ML_AVAILABLE and not self._caption_failed:
+            with self._caption_lock:
+                if self._caption_pipeline is None and not self._caption_failed:
+                    self._caption_pipeline = self._load_caption_pipeline()
+        return self._caption_pipeline
+
+    @property
+    def caption_cache_kind(self) -> str:
+        """
+        Cache namespace naming the caption backend, precision and quantization, so captions from another
+        model variant are never reused. Until the model loads, this is the variant the loader tries first.
+        """
+        return f'caption:{self._caption_variant or self._expected_caption_variant()}'
+
+    def _expected_caption_variant(self) -> str:
+        if CAPTION_BACKEND != 'transformers' and ORT_AVAILABLE:
+            provider, _ = onnx_caption_provider()
+            return onnx_caption_variant(provider, CAPTION_QUANTIZE == 'int8' and provider == 'CPUExecutionProvider')
+        return f"transformers:{self._caption_precision()}"
+
+    def _caption_precision(self) -> str:
+        # FP16 halves VRAM and runs the matmuls on Tensor Cores; CPUs stay on FP32
+        return "float16" if self.device == "cuda" else "float32"
+
+    def _load_caption_pipeline(self):
+        """Load the image captioning model. Called once, under the caption lock."""
+        try:
+            logger.info(f"Loading image captioning model on device: {self.device}")
+            model = self._load_onnx_caption_model()
+            if model is not None:
+                caption_pipeline = pipeline(
+                    "image-to-text",
+                    model=model,
+                    tokenizer=CAPTION_MODEL_NAME,
+                    image_processor=CAPTION_MODEL_NAME,
+                )
+            else:
+                precision = self._caption_precision()
+                caption_pipeline = pipeline(
+                    "image-to-text",
+                    model=CAPTION_MODEL_NAME,
+                    device=0 if self.device == "cuda" else -1,
+                    torch_dtype=getattr(torch, precision),
+                )
+                self._caption_variant = f"transformers:{precision}"
+            logger.info("Image captioning model loaded successfully")
+            return caption_pipeline
+        except Exception as e:
+            logger.error(f"Failed to load image captioning model: {e}")
+            self._caption_failed = True
+            return None
+
+    def _warm_up_caption_pipeline(self, caption_pipeline):
+        """
+        Run one tiny caption on a black image, so kernel JIT and cuDNN algorithm selection
+        happen now rather than on the first user's upload.
+        """
+        if self.device == "cuda":
+            # Pick the fastest conv algorithms once and reuse them; input sizes are fixed
+            torch.backends.cudnn.benchmark = True
+        try:
+            caption_pipeline(Image.new("RGB", (224, 224)), max_new_tokens=4)
+        except Exception as e:
+            logger.warning(f"Caption model warm-up failed: {e}")
+
+    def _load_onnx_caption_model(self):
+        """
+        Load the captioning model through ONNX Runtime, exporting it on first use.
+        Returns None when the transformers backend should be used instead.
+        """
+        if CAPTION_BACKEND == 'transformers':
+            return None
+        if not ORT_AVAILABLE:
+            if CAPTION_BACKEND == 'onnx':
+                logger.warning("optimum[onnxruntime] not installed, falling back to transformers for captioning")
+            return None
 
+        provider, provider_options = onnx_caption_provider()
         try:
-            logger.info(f"Initializing ML models on device: {self.device}")
-
-            # Initialize image captioning model
-            model_name = "nlpconnect/vit-gpt2-image-captioning"
-            self.caption_pipeline = pipeline(
-                "image-to-text",
-                model=model_name,
-                device=0 if self.device == "cuda" else -1,
+            if not os.path.exists(os.path.join(ONNX_MODEL_DIR, 'config.json')):
+                ORTModelForVision2Seq.from_pretrained(CAPTION_MODEL_NAME, export=True).save_pretrained(ONNX_MODEL_DIR)
+                logger.info(f"Exported image captioning model to ONNX in {ONNX_MODEL_DIR}")
+
+            file_names = {}
+            if CAPTION_QUANTIZE == 'int8' and provider == 'CPUExecutionProvider':
+                try:
+                    file_names = quantize_onnx_model(ONNX_MODEL_DIR)
+                except Exception as e:
+                    logger.warning(f"Failed to quantize ONNX captioning model, using FP32 weights: {e}")
+
+            model = ORTModelForVision2Seq.from_pretrained(
+                ONNX_MODEL_DIR,
+                provider=provider,
+                provider_options=provider_options,
+                **file_names,
             )
+            logger.info(f"Image captioning model running on ONNX Runtime ({provider})")
+            self._caption_variant = onnx_caption_variant(provider, bool(file_names))
+            return model
+        except Exception as e:
+            logger.warning(f"Failed to load ONNX captioning model, falling back to transformers: {e}")
+            return None
 
-            # Initialize Azure Computer Vision client
-            if AZURE_AVAILABLE:
-                endpoint = os.getenv('AZURE_COMPUTER_VISION_ENDPOINT')
-                key = os.getenv('AZURE_COMPUTER_VISION_KEY')
-                
-                if endpoint and key:
-                    credentials = CognitiveServicesCredentials(key)
-                    self.azure_client = ComputerVisionClient(endpoint, credentials)
-                    logger.info("Azure Computer Vision client initialized successfully")
-                else:
-                    logger.warning("Azure credentials not found in environment variables")
-                    self.azure_client = None
+    def _initialize_detector(self):
+        """Create the configured object detector. Its dependencies are only imported here."""
+        if self.detector_name == 'none':
+            return
+        detector_class = OBJECT_DETECTORS.get(self.detector_name)
+        if detector_class is None:
+            logger.warning(f"Unknown object detector {self.detector_name!r}. Object detection will be disabled.")
+            return
+
+        try:
+            self.detector = detector_class()
+        except ImportError as e:
+            logger.warning(f"Object detector {self.detector_name!r} not available ({e}). "
+                           "Object detection will be disabled.")
+
+    def _initialize_cache(self):
+        """Open the on-disk result cache, if diskcache is installed."""
+        if not DISKCACHE_AVAILABLE or not ML_CACHE_DIR:
+            return
 
-            logger.info("ML models initialized successfully")
+        try:
+            self.cache = diskcache.Cache(ML_CACHE_DIR, size_limit=ML_CACHE_SIZE_LIMIT)
+        except Exception as e:
+            logger.warning(f"Failed to open ML result cache at {ML_CACHE_DIR}: {e}")
+            self.cache = None
+
+    def _cache_digest(self, source: ImageSource) -> Optional[str]:
+        """Content hash identifying an image in the cache, or None when there's no cache."""
+        if self.cache is None:
+            return None
+        try:
+            return content_hash(source)
+        except OSError as e:
+            logger.warning(f"Failed to hash image {describe_source(source)}: {e}")
+            return None
 
+    def _cache_get(self, kind: str, digest: Optional[str]):
+        if digest is None:
+            return None
+        try:
+            return self.cache.get((kind, digest))
         except Exception as e:
-            logger.error(f"Failed to initialize ML models: {e}")
-            self.caption_pipeline = None
-            self.azure_client = None
+            logger.warning(f"ML result cache lookup failed: {e}")
+            return None
+
+    def _cache_set(self, kind: str, digest: Optional[str], value):
+        if digest is None or value is None:
+            return
+        try:
+            self.cache.set((kind, digest), value)
+        except Exception as e:
+            logger.warning(f"ML result cache write failed: {e}")
 
     def generate_alternative_text(self, image_path: str) -> Optional[str]:
         """
         Generate alternative text description for an image.
         """
+        return self.generate_alternative_text_batch([image_path])[0]
+
+    def generate_alternative_text_from_bytes(self, data: bytes) -> Optional[str]:
+        """
+        Generate alternative text for an image already in memory, without reading it from disk again.
+        """
+        return self.generate_alternative_text_batch([data])[0]
+
+    def generate_alternative_text_batch(self, sources: list[ImageSource]) -> list[Optional[str]]:
+        """
+        Generate alternative text for several images (paths or bytes) in one batched pipeline call.
+        Returns a list of captions (or None) in the same order as sources.
+        """
+        if not sources:
+            return []
+        digests = [self._cache_digest(source) for source in sources]
+        kind = self.caption_cache_kind
+        captions = [self._cache_get(kind, digest) for digest in digests]
+        misses = [i for i, caption in enumerate(captions) if caption is None]
+        if not misses:
+            return captions
         if not ML_AVAILABLE or not self.caption_pipeline:
             logger.warning("ML service not available")
-            return None
+            return captions
+
+        generated = self._caption_images([sources[i] for i in misses])
+        # Now that the model has loaded, store under the variant that actually produced the captions
+        kind = self.caption_cache_kind
+        for i, caption in zip(misses, generated):
+            captions[i] = caption
+            self._cache_set(kind, digests[i], caption)
+        return captions
+
+    def _caption_images(self, sources: list[ImageSource]) -> list[Optional[str]]:
+        if self._can_preprocess_on_gpu():
+            try:
+                return self._caption_on_gpu(sources)
+            except Exception as e:
+                logger.warning(f"GPU preprocessing failed, falling back to the CPU pipeline: {e}")
+        return self._caption_on_cpu(sources)
+
+    def _can_preprocess_on_gpu(self) -> bool:
+        model = self.caption_pipeline.model
+        image_processor = getattr(self.caption_pipeline, 'image_processor', None)
+        return (
+            TORCHVISION_AVAILABLE
+            and self.device == "cuda"
+            and image_processor is not None
+            and getattr(model, 'device', None) is not None
+            and model.device.type == "cuda"
+        )
+
+    def _caption_on_cpu(self, sources: list[ImageSource]) -> list[Optional[str]]:
+        """Decode images with PIL and let the pipeline preprocess them on the CPU."""
+        # The model only sees its input size, so there's no point decoding full-resolution pixels
+        image_processor = getattr(self.caption_pipeline, 'image_processor', None)
+        size = None
+        if image_processor is not None and 'height' in image_processor.size:
+            size = (image_processor.size['width'], image_processor.size['height'])
 
+        captions: list[Optional[str]] = [None] * len(sources)
+        images, indexes = [], []
+        for i, source in enumerate(sources):
+            try:
+                images.append(open_image(source, size))
+                indexes.append(i)
+            except Exception as e:
+                logger.error(f"Error opening image {describe_source(source)}: {e}")
+
+        for i, caption in zip(indexes, self._caption_pil(images)):
+            captions[i] = caption
+            if caption is None:
+                logger.warning(f"No caption generated for {describe_source(sources[i])}")
+        return captions
+
+    def _caption_pil(self, images: list) -> list[Optional[str]]:
+        """Caption decoded PIL images with the pipeline."""
+        if not images:
+            return []
         try:
-            image = Image.open(image_path).convert("RGB")
-            result = self.caption_pipeline(image, max_new_tokens=50)
-            if result and len(result) > 0:
-                caption = result[0]["generated_text"].strip()
-                logger.info(f"Generated alt text: {caption}")
-                return caption
-            logger.warning("No caption generated")
-            return None
+            results = self.caption_pipeline(
+                images,
+                batch_size=min(len(images), CAPTION_BATCH_SIZE),
+                max_new_tokens=50,
+            )
         except Exception as e:
-            logger.error(f"Error generating alternative text: {e}")
-            return None
+            if len(images) == 1:
+                logger.error(f"Error generating alternative text: {e}")
+                return [None]
+            # Batches mix unrelated uploads, so one bad image must not cost the others their captions
+            logger.warning(f"Batched captioning failed, retrying images one by one: {e}")
+            return [caption for image in images for caption in self._caption_pil([image])]
+
+        captions = []
+        for result in results:
+            caption = result[0]["generated_text"].strip() if result and len(result) > 0 else None
+            if caption:
+                logger.info(f"Generated alt text: {caption}")
+            captions.append(caption or None)
+        return captions
+
+    def _caption_on_gpu(self, sources: list[ImageSource]) -> list[Optional[str]]:
+        """
+        Decode, resize and normalize images on the GPU and feed the pixel values straight to
+        model.generate, skipping the pipeline's CPU image processor and the host-to-device copy.
+        """
+        model = self.caption_pipeline.model
+        image_processor = self.caption_pipeline.image_processor
+        tokenizer = self.caption_pipeline.tokenizer
+        size = [image_processor.size['height'], image_processor.size['width']]
+
+        captions: list[Optional[str]] = [None] * len(sources)
+        tensors, indexes, failed = [], [], []
+        for i, source in enumerate(sources):
+            try:
+                if isinstance(source, str):
+                    data = read_file(source)
+                else:
+                    data = torch.frombuffer(bytearray(source), dtype=torch.uint8)
+                if data[:3].tolist() == [0xFF, 0xD8, 0xFF]:
+                    # nvJPEG decodes directly into device memory
+                    image = decode_jpeg(data, mode=ImageReadMode.RGB, device=model.device)
+                else:
+                    image = decode_image(data, mode=ImageReadMode.RGB).to(model.device)
+                tensors.append(resize(image, size, antialias=True))
+                indexes.append(i)
+            except Exception as e:
+                # e.g. JPEGs nvJPEG rejects (CMYK, some progressive files); PIL may still decode them
+                logger.warning(f"GPU decode failed for {describe_source(source)}, using PIL: {e}")
+                failed.append(i)
+        if failed:
+            for i, caption in zip(failed, self._caption_on_cpu([sources[i] for i in failed])):
+                captions[i] = caption
+        if not tensors:
+            return captions
+
+        pixel_values = torch.stack(tensors).float().div_(255)
+        pixel_values = normalize(pixel_values, image_processor.image_mean, image_processor.image_std)
+        # Match the model's weights, e.g. FP16 on CUDA
+        dtype = getattr(model, 'dtype', None)
+        if isinstance(dtype, torch.dtype):
+            pixel_values = pixel_values.to(dtype)
+
+        for start in range(0, len(indexes), CAPTION_BATCH_SIZE):
+            with torch.inference_mode():
+                output_ids = model.generate(
+                    pixel_values=pixel_values[start:start + CAPTION_BATCH_SIZE],
+                    max_new_tokens=50,
+                )
+            texts = tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+            for i, text in zip(indexes[start:start + CAPTION_BATCH_SIZE], texts):
+                if text.strip():
+                    captions[i] = text.strip()
+                    logger.info(f"Generated alt text: {captions[i]}")
+                else:
+                    logger.warning(f"No caption generated for {describe_source(sources[i])}")
+        return captions
 
     def detect_objects(self, image_path: str) -> Optional[str]:
         """
-        Detect objects in an image using Azure Computer Vision API and return as JSON string.
+        Detect objects in an image with the configured detector and return as JSON string.
         Returns a JSON string containing list of detected objects with confidence scores.
         """
-        if not AZURE_AVAILABLE or not self.azure_client:
-            logger.warning("Azure Computer Vision not available for object detection")
-            return None
+        return self.detect_objects_batch([image_path])[0]
 
-        try:
-            # Read image file and pass file object to Azure API
-            with open(image_path, 'rb') as image_file:
-                # Call Azure Computer Vision API for object detection
-                analysis = self.azure_client.analyze_image_in_stream(
-                    image_file,
-                    visual_features=[VisualFeatureTypes.objects]
-                )
-            
-            detected_objects = []
-            
-            # Debug: Log the analysis response structure
-            logger.info(f"Azure analysis response type: {type(analysis)}")
-            logger.info(f"Azure analysis attributes: {dir(analysis)}")
-            
-            # Extract objects from Azure response
-            if hasattr(analysis, 'objects') and analysis.objects:
-                logger.info(f"Found {len(analysis.objects)} objects in Azure response")
-                for i, obj in enumerate(analysis.objects):
-                    logger.info(f"Object {i}: type={type(obj)}, attributes={dir(obj)}")
-                for obj in analysis.objects:
-                    # Azure Computer Vision API returns objects with different property names
-                    if hasattr(obj, 'object') and hasattr(obj, 'confidence'):
-                        object_name = obj.object
-                        confidence = obj.confidence
-                    elif hasattr(obj, 'object_property') and hasattr(obj, 'confidence'):
-                        object_name = obj.object_property
-                        confidence = obj.confidence
-                    else:
-                        # Try to get object name from other possible attributes
-                        object_name = getattr(obj, 'name', getattr(obj, 'label', 'unknown'))
-                        confidence = getattr(obj, 'confidence', 0.0)
-                    
-                    # Only include objects with confidence > 0.5
-                    if confidence > 0.5:
-                        detected_objects.append({
-                            'name': object_name,
-                            'confidence': round(confidence, 2)
-                        })
-            
-            # Remove duplicates and sort by confidence
-            unique_objects = {}
-            for obj in detected_objects:
-                name = obj['name']
-                if name not in unique_objects or obj['confidence'] > unique_objects[name]['confidence']:
-                    unique_objects[name] = obj
-            
-            final_objects = list(unique_objects.values())
-            final_objects.sort(key=lambda x: x['confidence'], reverse=True)
-            
+    def detect_objects_batch(self, image_paths: list[str]) -> list[Optional[str]]:
+        """
+        Detect objects in several images at once.
+        Returns a list of JSON strings (or None) in the same order as image_paths.
+        """
+        if not image_paths:
+            return []
+        digests = [self._cache_digest(path) for path in image_paths]
+        kind = self._objects_cache_kind()
+        cached = [self._cache_get(kind, digest) for digest in digests]
+        misses = [i for i, objects_json in enumerate(cached) if objects_json is None]
+        # Images known to contain no objects are cached too, so they aren't sent to the detector again
+        results = [None if objects_json == NO_OBJECTS else objects_json for objects_json in cached]
+        if not misses:
+            return results
+        if not self.is_object_detection_available():
+            logger.warning("Object detection not available")
+            return results
+
+        detections = self.detector.detect_batch([image_paths[i] for i in misses])
+        # The detector may have loaded other weights than expected, e.g. FP32 when the INT8 export failed
+        kind = self._objects_cache_kind()
+        for i, final_objects in zip(misses, detections):
             if final_objects:
-                objects_json = json.dumps(final_objects)
+                results[i] = dumps_json(final_objects)
                 logger.info(f"Detected objects: {[obj['name'] for obj in final_objects]}")
-                return objects_json
-            else:
+                self._cache_set(kind, digests[i], results[i])
+            elif final_objects is not None:
                 logger.info("No objects detected with sufficient confidence")
-                return None
-                
-        except Exception as e:
-            logger.error(f"Error detecting objects with Azure: {e}")
-            return None
+                self._cache_set(kind, digests[i], NO_OBJECTS)
+        return results
+
+    def _objects_cache_kind(self) -> str:
+        """Cache namespace naming the detector and, for YOLO, its weights, so other models' results aren't reused."""
+        return f'objects:{self.detector.cache_kind if self.detector is not None else self.detector_name}'
 
     def is_available(self) -> bool:
-        return ML_AVAILABLE and self.caption_pipeline is not None
+        # Don't touch caption_pipeline here: that would force the model to load
+        return ML_AVAILABLE and not self._caption_failed
 
     def is_object_detection_available(self) -> bool:
-        return AZURE_AVAILABLE and self.azure_client is not None
+        return self.detector is not None and self.detector.is_available()
+
+    def warm_up(self):
+        """Load and warm up the caption model and the object detector. Only used on the startup path."""
+        caption_pipeline = self.caption_pipeline
+        if caption_pipeline is not None:
+            self._warm_up_caption_pipeline(caption_pipeline)
+        if self.detector is not None:
+            self.detector.warm_up()
+
+
+def quantize_onnx_model(model_dir: str) -> dict:
+    """
+    Quantize the exported ONNX caption model to INT8 (dynamic, weights only) next to the FP32 files.
+    Quantized files are reused on later runs. Returns the file name arguments for from_pretrained.
+    """
+    if platform.machine().lower() in ('arm64', 'aarch64'):
+        quantization_config = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+    else:
+        # Uses VNNI int8 dot products where the CPU has them
+        quantization_config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+
+    file_names = {}
+    for argument, stem in ONNX_CAPTION_FILES:
+        if not os.path.exists(os.path.join(model_dir, f'{stem}.onnx')):
+            continue
+        quantized_name = f'{stem}_quantized.onnx'
+        if not os.path.exists(os.path.join(model_dir, quantized_name)):
+            quantizer = ORTQuantizer.from_pretrained(model_dir, file_name=f'{stem}.onnx')
+            quantizer.quantize(save_dir=model_dir, quantization_config=quantization_config)
+            logger.info(f"Quantized {stem}.onnx to INT8")
+        file_names[argument] = quantized_name
+    return file_names
+
+
+def onnx_caption_provider() -> tuple[str, dict]:
+    """Pick the fastest available ONNX Runtime execution provider and its options."""
+    providers = onnxruntime.get_available_providers()
+    if 'TensorrtExecutionProvider' in providers:
+        # TensorRT builds FP16 engines and caches them next to the ONNX files
+        return 'TensorrtExecutionProvider', {
+            'trt_fp16_enable': True,
+            'trt_engine_cache_enable': True,
+            'trt_engine_cache_path': os.path.join(ONNX_MODEL_DIR, 'trt_cache'),
+        }
+    if 'CUDAExecutionProvider' in providers:
+        return 'CUDAExecutionProvider', {}
+    return 'CPUExecutionProvider', {}
+
+
+def onnx_caption_variant(provider: str, quantized: bool) -> str:
+    return f"onnx:{provider}:int8" if quantized else f"onnx:{provider}"
+
+
+def open_image(source: ImageSource, size: Optional[tuple] = None):
+    """
+    Open an image from a path or from in-memory bytes as an RGB PIL image.
+    With size, JPEGs are decoded at the smallest libjpeg scale (1/2, 1/4, 1/8) that still covers it.
+    """
+    image = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+    if size:
+        # No-op for formats other than JPEG
+        image.draft("RGB", size)
+    return image.convert("RGB")
+
+
+def describe_source(source: ImageSource) -> str:
+    return source if isinstance(source, str) else f"<{len(source)} bytes>"
+
+
+def content_hash(source: ImageSource) -> str:
+    """Hash an image's bytes; files are hashed through mmap, without copying them into Python memory."""
+    if not isinstance(source, str):
+        return content_hasher(source).hexdigest()
+    with open(source, 'rb') as image_file:
+        if os.fstat(image_file.fileno()).st_size == 0:
+            return content_hasher(b'').hexdigest()
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return content_hasher(mm).hexdigest()
+
+
+class CaptionBatcher:
+    """
+    Coalesce concurrent caption requests into batched pipeline calls.
+    Requests arriving within CAPTION_BATCH_WINDOW of each other share one forward pass.
+    """
+
+    def __init__(self, service: MLImageService, batch_size: int = CAPTION_BATCH_SIZE,
+                 window: float = CAPTION_BATCH_WINDOW):
+        self.service = service
+        self.batch_size = max(batch_size, 1)
+        self.window = window
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._worker = threading.Thread(target=self._run, name='caption-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, source: ImageSource) -> Future:
+        """Queue an image (path or bytes) for captioning; the returned future resolves to its caption or None."""
+        future = Future()
+        with self._condition:
+            self._pending.append((source, future))
+            self._condition.notify()
+        return future
+
+    def _next_batch(self) -> list:
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            size = min(len(self._pending), self.batch_size)
+            return [self._pending.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                captions = self.service.generate_alternative_text_batch([source for source, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), caption in zip(batch, captions):
+                future.set_result(caption)
 
 
 _ml_service: Optional[MLImageService] = None
+_ml_service_lock = threading.Lock()
+_caption_batcher: Optional[CaptionBatcher] = None
+_caption_batcher_lock = threading.Lock()
 
 
 def get_ml_service() -> MLImageService:
     global _ml_service
-    if _ml_service is None:
-        _ml_service = MLImageService()
+    # The warm-up thread and request threads must share one instance, or the warmed model is thrown away
+    with _ml_service_lock:
+        if _ml_service is None:
+            _ml_service = MLImageService()
     return _ml_service
 
 
+def get_caption_batcher() -> CaptionBatcher:
+    global _caption_batcher
+    with _caption_batcher_lock:
+        if _caption_batcher is None:
+            _caption_batcher = CaptionBatcher(get_ml_service())
+    return _caption_batcher
+
+
+def warm_up_in_background():
+    """Load and warm up the models in a daemon thread, so app startup isn't blocked."""
+    threading.Thread(target=lambda: get_ml_service().warm_up(), name='ml-warm-up', daemon=True).start()
+
+
 def is_ml_available() -> bool:
     service = get_ml_service()
     return service.is_available()
-
-
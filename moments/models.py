@@ -4,11 +4,12 @@ from typing import Optional
 from flask import current_app
 from flask_avatars import Identicon
 from flask_login import UserMixin
-from sqlalchemy import Column, ForeignKey, String, Text, event, func, select, engine
+from sqlalchemy import Column, Float, ForeignKey, Index, String, Text, event, func, select, engine
 from sqlalchemy.orm import Mapped, WriteOnlyMapped, mapped_column, relationship
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from moments.core.extensions import db, whooshee
+from moments.utils import loads_json
 
 
 role_permission = db.Table(
@@ -304,6 +305,9 @@ class Photo(db.Model):
         back_populates='photo', cascade='all, delete-orphan', passive_deletes=True
     )
     tags: Mapped[list['Tag']] = relationship(secondary=photo_tag, back_populates='photos', passive_deletes=True)
+    objects: Mapped[list['PhotoObject']] = relationship(
+        back_populates='photo', cascade='all, delete-orphan', passive_deletes=True
+    )
 
     @property
     def collectors_count(self):
@@ -322,15 +326,34 @@ class Photo(db.Model):
         if not self.detected_objects:
             return []
         try:
-            import json
-            return json.loads(self.detected_objects)
-        except (json.JSONDecodeError, TypeError):
+            return loads_json(self.detected_objects)
+        except (ValueError, TypeError):
             return []
 
     def __repr__(self):
         return f'Photo {self.id}: {self.filename}'
 
 
+class PhotoObject(db.Model):
+    """An ML-detected object, one row per object so photos can be looked up by object name."""
+
+    __tablename__ = 'photo_object'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(String(64))
+    confidence: Mapped[float] = mapped_column(Float)
+
+    photo_id: Mapped[int] = mapped_column(ForeignKey('photo.id', ondelete='CASCADE'), index=True)
+
+    photo: Mapped['Photo'] = relationship(back_populates='objects')
+
+    # Find photos by object name, most confident first
+    __table_args__ = (Index('photo_object_name_conf_idx', name.column, confidence.column.desc()),)
+
+    def __repr__(self):
+        return f'PhotoObject {self.id}: {self.name}'
+
+
 # @whooshee.register_model('name')  # Temporarily disabled
 class Tag(db.Model):
     __tablename__ = 'tag'
@@ -66,6 +66,10 @@ class BaseConfig:
 
     WHOOSHEE_MIN_STRING_LEN = 1
     MOMENTS_SLOW_QUERY_THRESHOLD = 1
+    # sync: migrate before serving, async: migrate in a background thread on the first request, skip: don't migrate
+    MOMENTS_MIGRATION_MODE = os.getenv('MIGRATION_MODE', 'async')
+    # Load the ML models in the background from the first request instead of on the first upload
+    MOMENTS_ML_WARMUP = os.getenv('ML_WARMUP', 'false').lower() == 'true'
 
 
 class DevelopmentConfig(BaseConfig):
@@ -77,6 +81,7 @@ class TestingConfig(BaseConfig):
     TESTING = True
     WTF_CSRF_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///'  # in-memory database
+    MOMENTS_MIGRATION_MODE = 'skip'
 
 
 class ProductionConfig(BaseConfig):
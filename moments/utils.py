@@ -1,3 +1,4 @@
+import json
 import uuid
 from datetime import datetime, timedelta, timezone
 from urllib.parse import urljoin, urlparse
@@ -9,6 +10,25 @@ from flask import current_app, flash, redirect, request, url_for
 from jwt.exceptions import InvalidTokenError
 from PIL import Image
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps_json(obj):
+    """Serialize obj to a JSON string, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def loads_json(data):
+    """Parse a JSON str or bytes, using orjson when it is installed. Raises ValueError on invalid JSON."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 def generate_token(user, operation, expiration=3600, **kwargs):
     payload = {
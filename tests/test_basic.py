@@ -1,5 +1,9 @@
+from unittest import mock
+
 from flask import current_app
 
+from moments import create_app
+from moments.settings import TestingConfig
 from tests import BaseTestCase
 
 
@@ -15,3 +19,14 @@ class BasicTestCase(BaseTestCase):
         data = response.get_data(as_text=True)
         self.assertEqual(response.status_code, 404)
         self.assertIn('404 Error', data)
+
+    def test_ml_warm_up_starts_on_first_request(self):
+        with mock.patch.object(TestingConfig, 'MOMENTS_ML_WARMUP', True), \
+                mock.patch('moments.ml_service.warm_up_in_background') as warm_up_in_background:
+            app = create_app('testing')
+            # CLI commands never handle a request, so they never load the models
+            warm_up_in_background.assert_not_called()
+            client = app.test_client()
+            client.get('/foo')
+            client.get('/foo')
+        warm_up_in_background.assert_called_once()
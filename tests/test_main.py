@@ -1,5 +1,12 @@
 import io
+import shutil
+import tempfile
 from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+from PIL import Image
+from sqlalchemy import text
 
 from moments.core.extensions import db
 from moments.models import Comment, Notification, Photo, Tag, User
@@ -18,6 +25,12 @@ class MainTestCase(BaseTestCase):
         self.assertNotIn('Join Now', data)
         self.assertIn('My Home', data)
 
+    def test_healthz(self):
+        response = self.client.get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['status'], 'ok')
+        self.assertEqual(response.json['migrations']['status'], 'skipped')
+
     def test_explore_page(self):
         response = self.client.get('/explore')
         data = response.get_data(as_text=True)
@@ -342,3 +355,44 @@ class MainTestCase(BaseTestCase):
         data = response.get_data(as_text=True)
         self.assertEqual(response.status_code, 400)
         self.assertIn('Invalid image.', data)
+
+    def upload_with_detected_objects(self):
+        upload_path = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, upload_path)
+        self.app.config['MOMENTS_UPLOAD_PATH'] = upload_path
+        image = io.BytesIO()
+        Image.new('RGB', (10, 10)).save(image, 'JPEG')
+        image.seek(0)
+
+        ml_service = mock.Mock()
+        ml_service.is_available.return_value = False
+        ml_service.is_object_detection_available.return_value = True
+        ml_service.detect_objects.return_value = (
+            '[{"name": " dog ", "confidence": 0.91}, {"name": "cat", "confidence": 0.6}, {"name": " "}]'
+        )
+
+        self.login()
+        with mock.patch('moments.ml_service.get_ml_service', return_value=ml_service):
+            return self.client.post('/upload', data=dict(file=(image, 'test.jpg')))
+
+    def test_upload_image_with_detected_objects(self):
+        response = self.upload_with_detected_objects()
+        self.assertEqual(response.status_code, 302)
+
+        photo = db.session.get(Photo, 3)
+        self.assertEqual(
+            sorted((obj.name, obj.confidence) for obj in photo.objects), [('cat', 0.6), ('dog', 0.91)]
+        )
+        self.assertEqual(sorted(tag.name for tag in photo.tags), ['cat', 'dog'])
+
+    def test_upload_image_without_photo_object_table(self):
+        # e.g. MIGRATION_MODE=skip before the migration scripts were run
+        db.session.commit()
+        with db.engine.begin() as conn:
+            conn.execute(text('DROP TABLE photo_object'))
+        response = self.upload_with_detected_objects()
+        self.assertEqual(response.status_code, 302)
+
+        photo = db.session.get(Photo, 3)
+        self.assertIn('dog', photo.detected_objects)
+        self.assertEqual(sorted(tag.name for tag in photo.tags), ['cat', 'dog'])
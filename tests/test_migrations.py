@@ -0,0 +1,105 @@
+from unittest import mock
+
+from sqlalchemy import text
+
+from moments import create_app
+from moments.core.extensions import db
+from moments.core.migrations import (
+    MIGRATION_STATE,
+    add_detected_objects_column,
+    add_photo_column,
+    create_photo_object_table,
+    photo_columns,
+    register_migrations,
+    run_migrations,
+)
+from tests import BaseTestCase
+
+
+class MigrationTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        # Start from the schema before the ML columns existed
+        db.session.commit()
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE photo DROP COLUMN detected_objects'))
+        state = dict(MIGRATION_STATE)
+        self.addCleanup(self.restore_migration_state, state)
+
+    @staticmethod
+    def restore_migration_state(state):
+        MIGRATION_STATE.clear()
+        MIGRATION_STATE.update(state)
+
+    def test_add_photo_column(self):
+        with db.engine.begin() as conn:
+            self.assertNotIn('detected_objects', photo_columns(conn))
+            self.assertTrue(add_detected_objects_column(conn))
+            self.assertIn('detected_objects', photo_columns(conn))
+
+    def test_add_photo_column_twice(self):
+        with db.engine.begin() as conn:
+            self.assertTrue(add_photo_column(conn, 'detected_objects', 'TEXT'))
+            self.assertFalse(add_photo_column(conn, 'detected_objects', 'TEXT'))
+            self.assertIn('detected_objects', photo_columns(conn))
+
+    def test_add_photo_column_updates_columns(self):
+        with db.engine.begin() as conn:
+            columns = photo_columns(conn)
+            self.assertTrue(add_detected_objects_column(conn, columns))
+            self.assertIn('detected_objects', columns)
+            # The shared column set is trusted, so the second call doesn't touch the database
+            self.assertFalse(add_detected_objects_column(conn, columns))
+
+    def test_create_photo_object_table(self):
+        with db.engine.begin() as conn:
+            conn.execute(text('DROP TABLE photo_object'))
+            self.assertTrue(create_photo_object_table(conn))
+            self.assertFalse(create_photo_object_table(conn))
+            indexes = {index['name']: index['column_names'] for index in db.inspect(conn).get_indexes('photo_object')}
+        self.assertEqual(indexes['photo_object_name_conf_idx'], ['name', 'confidence'])
+
+    def test_run_migrations(self):
+        with db.engine.begin() as conn:
+            conn.execute(text('DROP TABLE photo_object'))
+        run_migrations(self.app)
+        self.assertEqual(MIGRATION_STATE['status'], 'done')
+        self.assertEqual(MIGRATION_STATE['applied'], ['add_detected_objects_column', 'create_photo_object_table'])
+        with db.engine.connect() as conn:
+            self.assertIn('detected_objects', photo_columns(conn))
+            self.assertTrue(db.inspect(conn).has_table('photo_object'))
+
+        run_migrations(self.app)
+        self.assertEqual(MIGRATION_STATE['status'], 'done')
+        self.assertEqual(MIGRATION_STATE['applied'], [])
+
+    def test_run_migrations_without_photo_table(self):
+        # A separate app gets its own empty in-memory database
+        app = create_app('testing')
+        run_migrations(app)
+        self.assertEqual(MIGRATION_STATE['status'], 'done')
+        self.assertEqual(MIGRATION_STATE['applied'], [])
+        with app.app_context(), db.engine.connect() as conn:
+            self.assertFalse(db.inspect(conn).has_table('photo'))
+            self.assertFalse(db.inspect(conn).has_table('photo_object'))
+
+    def test_run_migrations_failed(self):
+        def broken_migration(conn, columns):
+            raise RuntimeError('secret connection details')
+
+        with mock.patch('moments.core.migrations.MIGRATIONS', (broken_migration,)):
+            run_migrations(self.app)
+        self.assertEqual(MIGRATION_STATE['status'], 'failed')
+        self.assertNotIn('secret connection details', str(MIGRATION_STATE))
+
+    def test_async_migrations_start_on_first_request(self):
+        app = create_app('testing')
+        app.config['MOMENTS_MIGRATION_MODE'] = 'async'
+        with mock.patch('moments.core.migrations.threading.Thread') as thread:
+            register_migrations(app)
+            # CLI commands never handle a request, so they never start the migration thread
+            thread.assert_not_called()
+            client = app.test_client()
+            client.get('/healthz')
+            client.get('/healthz')
+        thread.assert_called_once()
@@ -0,0 +1,380 @@
+import importlib
+import importlib.util
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from moments.ml_service import (
+    AZURE_ANALYZE_PATH,
+    NO_OBJECTS,
+    AzureObjectDetector,
+    CaptionBatcher,
+    MLImageService,
+    YOLOObjectDetector,
+    best_objects,
+    content_hash,
+)
+
+
+class BestObjectsTestCase(unittest.TestCase):
+    def test_confidence_threshold(self):
+        objects = best_objects([('dog', 0.5), ('cat', 0.49), ('car', 0.51)])
+        self.assertEqual(objects, [{'name': 'car', 'confidence': 0.51}])
+
+    def test_keep_most_confident_per_name(self):
+        objects = best_objects([('dog', 0.6), ('dog', 0.9), ('dog', 0.7)])
+        self.assertEqual(objects, [{'name': 'dog', 'confidence': 0.9}])
+
+    def test_sorted_by_confidence(self):
+        objects = best_objects([('cat', 0.6), ('dog', 0.95), ('car', 0.8), ('cat', 0.7)])
+        self.assertEqual([obj['name'] for obj in objects], ['dog', 'car', 'cat'])
+        self.assertEqual([obj['confidence'] for obj in objects], [0.95, 0.8, 0.7])
+
+    def test_ties_keep_first_seen_order(self):
+        objects = best_objects([('cat', 0.8), ('dog', 0.8), ('cat', 0.8)])
+        self.assertEqual([obj['name'] for obj in objects], ['cat', 'dog'])
+
+    def test_confidence_rounded(self):
+        self.assertEqual(best_objects([('dog', 0.876)]), [{'name': 'dog', 'confidence': 0.88}])
+
+    def test_no_detections(self):
+        self.assertEqual(best_objects([]), [])
+
+
+def azure_response(objects):
+    response = mock.Mock(content=json.dumps({'objects': objects}).encode())
+    response.raise_for_status.return_value = None
+    return response
+
+
+@unittest.skipUnless(importlib.util.find_spec('requests'), 'requests not installed.')
+class AzureObjectDetectorTestCase(unittest.TestCase):
+    def setUp(self):
+        env = {'AZURE_COMPUTER_VISION_ENDPOINT': 'https://vision.example.com/', 'AZURE_COMPUTER_VISION_KEY': 'key'}
+        with mock.patch.dict(os.environ, env):
+            self.detector = AzureObjectDetector()
+        self.session = self.detector._session = mock.Mock()
+
+        self.image_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.image_dir.cleanup)
+        self.paths = []
+        for name in ['a', 'b', 'c']:
+            path = os.path.join(self.image_dir.name, f'{name}.jpg')
+            with open(path, 'wb') as image_file:
+                image_file.write(name.encode())
+            self.paths.append(path)
+
+    def test_missing_credentials(self):
+        with mock.patch.dict(os.environ, {'AZURE_COMPUTER_VISION_ENDPOINT': '', 'AZURE_COMPUTER_VISION_KEY': ''}):
+            self.assertFalse(AzureObjectDetector().is_available())
+        self.assertTrue(self.detector.is_available())
+
+    def test_detect(self):
+        self.session.post.return_value = azure_response([
+            {'object': 'dog', 'confidence': 0.7},
+            {'object': 'dog', 'confidence': 0.9},
+            {'object': 'cat', 'confidence': 0.4},
+            {'confidence': 0.8},
+        ])
+        objects = self.detector.detect(self.paths[0])
+        self.assertEqual(objects, [{'name': 'dog', 'confidence': 0.9}, {'name': 'unknown', 'confidence': 0.8}])
+
+        args, kwargs = self.session.post.call_args
+        self.assertEqual(args, ('https://vision.example.com' + AZURE_ANALYZE_PATH,))
+        self.assertEqual(kwargs['params'], {'visualFeatures': 'Objects'})
+        self.assertEqual(kwargs['headers'], {'Content-Type': 'application/octet-stream'})
+
+    def test_detect_no_objects(self):
+        self.session.post.return_value = mock.Mock(content=b'{"requestId": "1"}')
+        self.assertEqual(self.detector.detect(self.paths[0]), [])
+
+    def test_detect_http_error(self):
+        requests = importlib.import_module('requests')
+        response = azure_response([])
+        response.raise_for_status.side_effect = requests.HTTPError('429 Too Many Requests')
+        self.session.post.return_value = response
+        self.assertIsNone(self.detector.detect(self.paths[0]))
+
+    def test_detect_missing_file(self):
+        self.assertIsNone(self.detector.detect(os.path.join(self.image_dir.name, 'missing.jpg')))
+        self.session.post.assert_not_called()
+
+    def post_named_after_file(self, url, data, **kwargs):
+        name = data.read().decode()
+        if name == 'a':
+            # Finish the first request last
+            time.sleep(0.05)
+        return azure_response([{'object': name, 'confidence': 0.9}])
+
+    def test_detect_batch_keeps_order(self):
+        self.session.post.side_effect = self.post_named_after_file
+        objects = self.detector.detect_batch(self.paths)
+        self.assertEqual([result[0]['name'] for result in objects], ['a', 'b', 'c'])
+        self.assertEqual(self.session.post.call_count, 3)
+
+    def test_detect_batch_timeout(self):
+        released = threading.Event()
+        self.addCleanup(released.set)
+
+        def post(url, data, **kwargs):
+            name = data.read().decode()
+            if name == 'a':
+                released.wait(5)
+            return azure_response([{'object': name, 'confidence': 0.9}])
+
+        self.session.post.side_effect = post
+        with mock.patch('moments.ml_service.AZURE_TIMEOUT', 0.1):
+            objects = self.detector.detect_batch(self.paths[:2])
+        self.assertEqual(objects, [None, [{'name': 'b', 'confidence': 0.9}]])
+
+
+class FakeTensor:
+    """Stands in for a torch tensor: .cpu().numpy() returns the wrapped array."""
+
+    def __init__(self, array):
+        self.array = array
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+def fake_result(classes, confidences, names):
+    np = importlib.import_module('numpy')
+    boxes = mock.Mock(
+        cls=FakeTensor(np.array(classes, dtype=np.float32)), conf=FakeTensor(np.array(confidences, dtype=np.float32))
+    )
+    return mock.Mock(boxes=boxes, names=names)
+
+
+@unittest.skipUnless(importlib.util.find_spec('numpy'), 'numpy not installed.')
+class YOLOObjectDetectorTestCase(unittest.TestCase):
+    names = {0: 'person', 1: 'dog', 2: 'cat'}
+
+    def setUp(self):
+        self.ultralytics = mock.Mock()
+        self.model = self.ultralytics.YOLO.return_value
+        import_module = importlib.import_module
+
+        def fake_import(name):
+            return self.ultralytics if name == 'ultralytics' else import_module(name)
+
+        with mock.patch('moments.ml_service.importlib.import_module', side_effect=fake_import):
+            self.detector = YOLOObjectDetector()
+
+    def test_best_per_class(self):
+        result = fake_result([0, 1, 0, 2], [0.6, 0.9, 0.8, 0.4], self.names)
+        self.assertEqual(
+            self.detector._best_per_class(result),
+            [{'name': 'dog', 'confidence': 0.9}, {'name': 'person', 'confidence': 0.8}],
+        )
+
+    def test_best_per_class_ties_keep_box_order(self):
+        result = fake_result([2, 1, 2], [0.75, 0.75, 0.75], self.names)
+        self.assertEqual([obj['name'] for obj in self.detector._best_per_class(result)], ['cat', 'dog'])
+
+    def test_best_per_class_no_boxes(self):
+        self.assertEqual(self.detector._best_per_class(fake_result([], [], self.names)), [])
+        self.assertEqual(self.detector._best_per_class(fake_result([1], [0.3], self.names)), [])
+
+    def test_detect_batch(self):
+        self.model.return_value = [
+            fake_result([1], [0.7], self.names),
+            fake_result([0, 0], [0.55, 0.65], self.names),
+        ]
+        objects = self.detector.detect_batch(['a.jpg', 'b.jpg'])
+        # One batched model call for all images
+        self.model.assert_called_once_with(['a.jpg', 'b.jpg'], imgsz=640, conf=0.5, verbose=False)
+        self.assertEqual(objects, [[{'name': 'dog', 'confidence': 0.7}], [{'name': 'person', 'confidence': 0.65}]])
+
+    def test_detect_batch_failed(self):
+        self.model.side_effect = RuntimeError('CUDA error')
+        self.assertEqual(self.detector.detect_batch(['a.jpg', 'b.jpg']), [None, None])
+        self.assertTrue(self.detector.is_available())
+
+    def test_model_failed_to_load(self):
+        self.ultralytics.YOLO.side_effect = OSError('missing weights')
+        self.assertIsNone(self.detector.detect('a.jpg'))
+        self.assertFalse(self.detector.is_available())
+
+    def test_int8_model_exported_once(self):
+        with tempfile.TemporaryDirectory() as model_dir:
+            exported = os.path.join(model_dir, 'export')
+            os.mkdir(exported)
+            self.model.export.return_value = exported
+            weights = os.path.join(model_dir, 'yolov8n.pt')
+            with mock.patch.multiple('moments.ml_service', YOLO_MODEL=weights, YOLO_QUANTIZE='int8'):
+                self.assertIsNotNone(self.detector.model)
+            quantized_dir = os.path.join(model_dir, 'yolov8n_int8_openvino_model')
+            self.assertTrue(os.path.isdir(quantized_dir))
+            self.model.export.assert_called_once_with(format='openvino', int8=True, dynamic=True)
+            self.ultralytics.YOLO.assert_called_with(quantized_dir, task='detect')
+
+    def test_cache_kind_names_weights(self):
+        with mock.patch.multiple('moments.ml_service', YOLO_MODEL='yolov8x.pt', YOLO_QUANTIZE=''):
+            self.assertEqual(self.detector.cache_kind, 'yolo:yolov8x.pt')
+        with mock.patch.multiple('moments.ml_service', YOLO_MODEL='yolov8n.pt', YOLO_QUANTIZE='int8'):
+            self.assertEqual(self.detector.cache_kind, 'yolo:yolov8n_int8_openvino_model')
+
+    def test_cache_kind_after_int8_export_failed(self):
+        self.model.export.side_effect = RuntimeError('openvino not installed')
+        with tempfile.TemporaryDirectory() as model_dir:
+            weights = os.path.join(model_dir, 'yolov8n.pt')
+            with mock.patch.multiple('moments.ml_service', YOLO_MODEL=weights, YOLO_QUANTIZE='int8'):
+                self.assertIsNotNone(self.detector.model)
+                # Results come from the FP32 weights, so they must not be cached as INT8 ones
+                self.assertEqual(self.detector.cache_kind, f'yolo:{weights}')
+
+
+class StubCaptionService:
+    """Records each batch and captions every source as 'caption <source>'."""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def generate_alternative_text_batch(self, sources):
+        self.batches.append(list(sources))
+        if self.error:
+            raise self.error
+        return [f'caption {source}' for source in sources]
+
+
+class CaptionBatcherTestCase(unittest.TestCase):
+    def test_flush_on_batch_size(self):
+        service = StubCaptionService()
+        # The window is far longer than the test waits, so only a full batch can flush
+        batcher = CaptionBatcher(service, batch_size=3, window=60)
+        futures = [batcher.submit(source) for source in ['a', 'b', 'c']]
+        self.assertEqual([future.result(timeout=5) for future in futures], ['caption a', 'caption b', 'caption c'])
+        self.assertEqual(service.batches, [['a', 'b', 'c']])
+
+    def test_flush_on_window(self):
+        service = StubCaptionService()
+        batcher = CaptionBatcher(service, batch_size=8, window=0.01)
+        self.assertEqual(batcher.submit('a').result(timeout=5), 'caption a')
+        self.assertEqual(service.batches, [['a']])
+
+    def test_results_keep_order_across_batches(self):
+        service = StubCaptionService()
+        batcher = CaptionBatcher(service, batch_size=2, window=0.01)
+        futures = [batcher.submit(source) for source in ['a', 'b', 'c', 'd', 'e']]
+        self.assertEqual([future.result(timeout=5) for future in futures], [f'caption {s}' for s in 'abcde'])
+        self.assertTrue(all(len(batch) <= 2 for batch in service.batches))
+        self.assertEqual([source for batch in service.batches for source in batch], list('abcde'))
+
+    def test_exception_propagates(self):
+        service = StubCaptionService(error=RuntimeError('out of memory'))
+        batcher = CaptionBatcher(service, batch_size=2, window=60)
+        futures = [batcher.submit('a'), batcher.submit('b')]
+        for future in futures:
+            with self.assertRaisesRegex(RuntimeError, 'out of memory'):
+                future.result(timeout=5)
+
+        # The worker keeps serving later requests
+        service.error = None
+        futures = [batcher.submit('c'), batcher.submit('d')]
+        self.assertEqual([future.result(timeout=5) for future in futures], ['caption c', 'caption d'])
+
+
+class CaptionPILTestCase(unittest.TestCase):
+    def setUp(self):
+        with mock.patch('moments.ml_service.ML_CACHE_DIR', ''):
+            self.service = MLImageService(detector='none')
+
+        def caption_pipeline(images, **kwargs):
+            if 'bad' in images:
+                raise ValueError('cannot caption')
+            return [[{'generated_text': f' caption {image} '}] for image in images]
+
+        self.service._caption_pipeline = caption_pipeline
+
+    def test_caption_batch(self):
+        self.assertEqual(self.service._caption_pil(['a', 'b']), ['caption a', 'caption b'])
+
+    def test_failed_batch_retried_per_image(self):
+        self.assertEqual(self.service._caption_pil(['a', 'bad', 'b']), ['caption a', None, 'caption b'])
+
+
+class FakeCache:
+    """Dict-backed stand-in for diskcache.Cache."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+
+class CacheTestCase(unittest.TestCase):
+    def setUp(self):
+        with mock.patch('moments.ml_service.ML_CACHE_DIR', ''):
+            self.service = MLImageService(detector='none')
+        self.service.cache = FakeCache()
+
+        self.image_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.image_dir.cleanup)
+
+    def image(self, name, data):
+        path = os.path.join(self.image_dir.name, name)
+        with open(path, 'wb') as image_file:
+            image_file.write(data)
+        return path
+
+    def test_content_hash(self):
+        self.assertEqual(content_hash(self.image('a.jpg', b'image data')), content_hash(b'image data'))
+        self.assertNotEqual(content_hash(b'image data'), content_hash(b'other data'))
+        # mmap can't map an empty file
+        self.assertEqual(content_hash(self.image('empty.jpg', b'')), content_hash(b''))
+
+    def test_caption_cache_hit_skips_inference(self):
+        self.service.cache.set((self.service.caption_cache_kind, content_hash(b'image')), 'cached caption')
+        with mock.patch.object(self.service, '_caption_images') as caption_images:
+            self.assertEqual(self.service.generate_alternative_text_from_bytes(b'image'), 'cached caption')
+        caption_images.assert_not_called()
+
+    def test_caption_cache_miss(self):
+        self.service._caption_pipeline = mock.Mock()
+        with mock.patch('moments.ml_service.ML_AVAILABLE', True), \
+                mock.patch.object(self.service, '_caption_images', return_value=['a caption', None]) as caption_images:
+            self.assertEqual(self.service.generate_alternative_text_batch([b'one', b'two']), ['a caption', None])
+            caption_images.assert_called_once_with([b'one', b'two'])
+            # Failed captions aren't cached, so the second image is captioned again
+            caption_images.return_value = [None]
+            self.assertEqual(self.service.generate_alternative_text_batch([b'one', b'two']), ['a caption', None])
+            caption_images.assert_called_with([b'two'])
+        self.assertEqual(list(self.service.cache.data.values()), ['a caption'])
+
+    def test_caption_cache_ignores_other_model_variants(self):
+        self.service.cache.set(('caption:onnx:CPUExecutionProvider:int8', content_hash(b'image')), 'int8 caption')
+        self.service._caption_variant = 'transformers:float32'
+        self.service._caption_pipeline = mock.Mock()
+        with mock.patch('moments.ml_service.ML_AVAILABLE', True), \
+                mock.patch.object(self.service, '_caption_images', return_value=['fp32 caption']):
+            self.assertEqual(self.service.generate_alternative_text_from_bytes(b'image'), 'fp32 caption')
+
+    def test_objects_cache(self):
+        detector = self.service.detector = mock.Mock(cache_kind='fake')
+        detector.is_available.return_value = True
+        detector.detect_batch.return_value = [[{'name': 'dog', 'confidence': 0.9}], [], None]
+        paths = [self.image('dog.jpg', b'dog'), self.image('empty.jpg', b'empty'), self.image('failed.jpg', b'failed')]
+
+        objects = self.service.detect_objects_batch(paths)
+        self.assertEqual(json.loads(objects[0]), [{'name': 'dog', 'confidence': 0.9}])
+        self.assertEqual(objects[1:], [None, None])
+        self.assertEqual(self.service.cache.get(('objects:fake', content_hash(b'empty'))), NO_OBJECTS)
+        self.assertIsNone(self.service.cache.get(('objects:fake', content_hash(b'failed'))))
+
+        # Only the failed image goes back to the detector; the empty one comes from the cache as None
+        detector.detect_batch.return_value = [None]
+        self.assertEqual(self.service.detect_objects_batch(paths), objects)
+        detector.detect_batch.assert_called_with([paths[2]])